@@ -3,33 +3,42 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #   "Pillow>=10.0.0",
-#   "requests>=2.28.0",
 #   "tkinterdnd2>=0.3.0",
 # ]
 # ///
 """GhostPrint — управление 3D-печатью для принтеров на прошивке SHUI/Marlin."""
 
-import base64
+import binascii
+import contextlib
+import functools
+import hashlib
+import http.client
 import io
 import json
+import mmap
+import os
+import queue
 import re
+import select
 import socket
 import subprocess
 import threading
 import time
 import tkinter as tk
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 from tkinter import messagebox, simpledialog, ttk
 
 try:
-    import requests
-    HAS_REQUESTS = True
+    import orjson                    # optional: faster JSON parsing
+    _loads = orjson.loads
 except ImportError:
-    HAS_REQUESTS = False
+    _loads = json.loads
 
 try:
-    from PIL import Image, ImageDraw, ImageTk
+    from PIL import Image, ImageDraw, ImageTk, PngImagePlugin
     HAS_PIL = True
 except ImportError:
     HAS_PIL = False
@@ -44,8 +53,11 @@ except ImportError:
 
 # ── Settings ──────────────────────────────────────────────────────────────────
 
-SETTINGS_FILE = Path(__file__).parent / "settings.json"
-HISTORY_FILE  = Path(__file__).parent / "history.json"
+SETTINGS_FILE   = Path(__file__).parent / "settings.json"
+HISTORY_FILE    = Path(__file__).parent / "history.jsonl"
+_LEGACY_HISTORY = Path(__file__).parent / "history.json"
+TERMINAL_HISTORY_FILE = Path(__file__).parent / "terminal_history.txt"
+THUMB_CACHE_DIR = Path.home() / ".cache" / "ghostprint"
 
 _DEFAULTS = {
     "printer_ip":       "192.168.1.213",
@@ -55,15 +67,35 @@ _DEFAULTS = {
 }
 
 
+_json_cache: dict[Path, tuple[tuple[int, int], object]] = {}
+
+
+def _load_json_cached(path: Path, parse=_loads):
+    """Parse a JSON file, reusing the last result while (mtime, size) is unchanged.
+
+    The returned object is shared between callers — copy before mutating.
+    """
+    st  = path.stat()
+    key = (st.st_mtime_ns, st.st_size)
+    hit = _json_cache.get(path)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    data = parse(path.read_bytes())
+    _json_cache[path] = (key, data)
+    return data
+
+
 def load_settings() -> dict:
     try:
-        return {**_DEFAULTS, **json.loads(SETTINGS_FILE.read_text())}
+        return {**_DEFAULTS, **_load_json_cached(SETTINGS_FILE)}
     except Exception:
         return dict(_DEFAULTS)
 
 
 def save_settings(s: dict):
-    SETTINGS_FILE.write_text(json.dumps(s, indent=2, ensure_ascii=False))
+    # UTF-8 regardless of locale: load_settings parses the raw bytes
+    SETTINGS_FILE.write_text(json.dumps(s, indent=2, ensure_ascii=False),
+                             encoding="utf-8")
 
 
 _CFG = load_settings()
@@ -87,6 +119,12 @@ THUMB_SIZE    = 160
 CARD_W        = 210
 CARD_PAD      = 14
 
+# Thumbnails live in the G-code header; bigger ones still fit comfortably
+_THUMB_SCAN_LIMIT = 1 << 20
+# Print time sits in the header or footer; Prusa/Orca follow it with a
+# settings dump of several tens of KB, hence the generous window
+_TIME_SCAN_WINDOW = 128 * 1024
+
 COOLING_OPTIONS = [
     ("Нет",   0),
     ("1 мин", 60),
@@ -125,6 +163,7 @@ BTN_FG  = "#efefef"   # button text
 
 # ── Color helpers ─────────────────────────────────────────────────────────────
 
+@functools.lru_cache(maxsize=128)
 def _shade(hex_color: str, delta: int) -> str:
     """Lighten (delta>0) or darken (delta<0) a hex RGB color."""
     r = max(0, min(255, int(hex_color[1:3], 16) + delta))
@@ -133,6 +172,27 @@ def _shade(hex_color: str, delta: int) -> str:
     return f"#{r:02x}{g:02x}{b:02x}"
 
 
+# Pressed-state backgrounds for the button colors used across the UI
+_ACTIVE_BG = {c: _shade(c, -10) for c in (BTN_N, BLUE, BG_HDR, RED, GREEN)}
+
+
+# ── Text helpers ──────────────────────────────────────────────────────────────
+
+# Russian plural form index by n % 10 (1 файл, 2 файла, 5 файлов);
+# 11–14 always take the "many" form.
+_PLURAL_BY_LAST_DIGIT = (2, 0, 1, 1, 1, 2, 2, 2, 2, 2)
+
+
+def _plural(n: int, forms: tuple[str, str, str]) -> str:
+    """Pick the Russian plural form for n: forms = (one, few, many)."""
+    if 11 <= n % 100 <= 14:
+        return forms[2]
+    return forms[_PLURAL_BY_LAST_DIGIT[n % 10]]
+
+
+_FILE_FORMS = ("файл", "файла", "файлов")
+
+
 # ── G-code templates ──────────────────────────────────────────────────────────
 
 COOLING_BLOCK = """\
@@ -143,50 +203,157 @@ M106 S0
 ; ---
 """
 
+# ── Precompiled patterns ──────────────────────────────────────────────────────
+
+_RE_M84         = re.compile(rb'[ \t]*M84\b')
+# Header patterns are bytes: they run directly over the mmap'ed G-code file
+_RE_THUMB_SPAN  = re.compile(
+    rb'^; thumbnail begin (\d+)x(\d+)[^\n]*\n(.*?)^; thumbnail end',
+    re.DOTALL | re.MULTILINE)
+_RE_TIME_NORMAL = re.compile(rb'; estimated printing time \(normal mode\) = (.+)')
+_RE_TIME_SEC    = re.compile(rb';TIME:(\d+)')
+_RE_BUILD_TIME  = re.compile(rb'; Build time: (.+)')
+# T0? matches both "T:" (standard Marlin) and "T0:" (SHUI)
+_RE_TB          = re.compile(r'T0?:(\d+\.?\d*)\s*/(\d+\.?\d*).*B:(\d+\.?\d*)\s*/(\d+\.?\d*)')
+_RE_SDBYTE      = re.compile(r'SD printing byte (\d+)/(\d+)')
+
 # ── History ───────────────────────────────────────────────────────────────────
 
+# history.jsonl and terminal_history.txt hold one record per line, so adding
+# one is a single append. A file is cut back to its newest `max_lines` records
+# once it holds more than twice that, so the rewrite happens once per
+# `max_lines` appends however long the records are.
+
+_line_counts: dict[Path, int] = {}  # lines per file; counted on first append
+
+
+def _append_line(path: Path, line: str, max_lines: int, trim):
+    """Append `line` to `path`; call trim() once it holds > 2×max_lines lines.
+
+    trim() must rewrite the file through _rewrite_lines.
+    """
+    data = (line + "\n").encode()
+    with path.open("a+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end:
+            f.seek(end - 1)
+            if f.read(1) != b"\n":
+                # Finish a line cut short by a crash, or the new one joins it
+                # and both are dropped as unparseable
+                data = b"\n" + data
+        f.write(data)
+    if path not in _line_counts:
+        _line_counts[path] = path.read_bytes().count(b"\n")
+    else:
+        _line_counts[path] += data.count(b"\n")
+    if _line_counts[path] > 2 * max_lines:
+        trim()
+
+
+def _rewrite_lines(path: Path, lines: list[str]):
+    path.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+    _line_counts[path] = len(lines)
+
+
+HISTORY_MAX = 200
+
+
+def _parse_jsonl(raw: bytes) -> list:
+    entries = []
+    for line in raw.splitlines():
+        try:
+            entries.append(_loads(line))
+        except ValueError:
+            pass
+    return entries[-HISTORY_MAX:]
+
+
+def load_history() -> list[dict]:
+    try:
+        return _load_json_cached(HISTORY_FILE, _parse_jsonl)
+    except Exception:
+        return []
+
+
 def append_history(entry: dict):
-    hist = []
+    _append_line(HISTORY_FILE, json.dumps(entry, ensure_ascii=False),
+                 HISTORY_MAX, lambda: _write_history(load_history()))
+
+
+def _write_history(entries: list[dict]):
+    _rewrite_lines(HISTORY_FILE,
+                   [json.dumps(e, ensure_ascii=False) for e in entries])
+
+
+def _migrate_history():
+    """One-shot conversion of the old history.json array to history.jsonl."""
+    if HISTORY_FILE.exists() or not _LEGACY_HISTORY.exists():
+        return
     try:
-        hist = json.loads(HISTORY_FILE.read_text())
+        _write_history(_loads(_LEGACY_HISTORY.read_bytes())[-HISTORY_MAX:])
+        _LEGACY_HISTORY.unlink()
     except Exception:
         pass
-    hist.append(entry)
-    HISTORY_FILE.write_text(json.dumps(hist[-200:], indent=2))
+
+
+_migrate_history()
+
+# Terminal commands, one per line, newest last.
+
+TERMINAL_HISTORY_MAX = 100
+
+
+def load_terminal_history() -> list[str]:
+    try:
+        lines = TERMINAL_HISTORY_FILE.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    return [cmd for cmd in lines if cmd][-TERMINAL_HISTORY_MAX:]
+
+
+def append_terminal_history(cmd: str):
+    try:
+        _append_line(TERMINAL_HISTORY_FILE, cmd, TERMINAL_HISTORY_MAX,
+                     lambda: _rewrite_lines(TERMINAL_HISTORY_FILE,
+                                            load_terminal_history()))
+    except OSError:
+        pass
 
 # ── Thumbnail helpers ─────────────────────────────────────────────────────────
 
-def _extract_orca_thumbnail(text: str):
-    """Extract largest OrcaSlicer/BambuStudio embedded PNG thumbnail."""
+def _open_rgba(fp):
+    """Open and decode an image as RGBA, skipping the copy if it already is."""
+    img = Image.open(fp)
+    if img.mode != "RGBA":
+        return img.convert("RGBA")
+    img.load()
+    return img
+
+
+def _extract_orca_thumbnail(data):
+    """Extract largest OrcaSlicer/BambuStudio embedded PNG thumbnail.
+
+    `data` is any bytes-like object (bytes or mmap). Slicers write thumbnails
+    into the file header, so only the first _THUMB_SCAN_LIMIT bytes are searched.
+    """
     if not HAS_PIL:
         return None
-    best_img   = None
-    best_px    = 0
-    lines      = text.splitlines()
-    i          = 0
-    while i < len(lines):
-        m = re.match(r'^; thumbnail begin (\d+)x(\d+)', lines[i])
-        if m:
-            w, h = int(m.group(1)), int(m.group(2))
-            px   = w * h
-            i   += 1
-            b64  = ""
-            while i < len(lines) and not lines[i].startswith('; thumbnail end'):
-                ln = lines[i]
-                if ln.startswith('; '):
-                    b64 += ln[2:]
-                elif ln.startswith(';'):
-                    b64 += ln[1:]
-                i += 1
-            if px > best_px:
-                try:
-                    data    = base64.b64decode(b64)
-                    img     = Image.open(io.BytesIO(data)).convert("RGBA")
-                    best_px = px
-                    best_img = img
-                except Exception:
-                    pass
-        i += 1
+    best_img = None
+    best_px  = 0
+    for m in _RE_THUMB_SPAN.finditer(data, 0, _THUMB_SCAN_LIMIT):
+        px = int(m.group(1)) * int(m.group(2))
+        if px <= best_px:
+            continue
+        try:
+            # None of '; \t\r\n' is in the base64 alphabet, so one translate()
+            # pass strips the comment prefixes and line breaks together.
+            b64      = m.group(3).translate(None, b"; \t\r\n")
+            png      = binascii.a2b_base64(b64, strict_mode=False)
+            img      = _open_rgba(io.BytesIO(png))
+            best_px  = px
+            best_img = img
+        except Exception:
+            pass
     return best_img
 
 
@@ -198,14 +365,32 @@ def _load_companion_image(gcode_path: Path):
         p = gcode_path.with_suffix(ext)
         if p.exists():
             try:
-                return Image.open(p).convert("RGBA")
+                return _open_rgba(p)
             except Exception:
                 pass
     return None
 
 
+@contextlib.contextmanager
+def _map_file(path: Path):
+    """Memory-map `path` read-only (b"" for an empty file, which mmap rejects).
+
+    Buffer views of the map must be released before the block exits.
+    """
+    with path.open("rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            yield b""
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+@functools.lru_cache(maxsize=1)
 def _placeholder_photo():
-    """Dark placeholder with a minimal printer icon."""
+    """Dark placeholder with a minimal printer icon (built once, shared)."""
     if not HAS_PIL:
         return None
     img  = Image.new("RGBA", (THUMB_SIZE, THUMB_SIZE), "#1a1a1a")
@@ -223,24 +408,75 @@ def _placeholder_photo():
     return ImageTk.PhotoImage(img)
 
 
-def _make_thumb_photo(img):
+def _fit_thumb(img):
     """Fit image inside THUMB_SIZE×THUMB_SIZE, letterbox on dark bg."""
+    if img.size == (THUMB_SIZE, THUMB_SIZE):
+        return img
+    # BOX is exact for ≥2× downscales; BILINEAR is plenty at 160 px
+    big   = img.width >= 2 * THUMB_SIZE and img.height >= 2 * THUMB_SIZE
     thumb = img.copy()
-    thumb.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.LANCZOS)
+    thumb.thumbnail((THUMB_SIZE, THUMB_SIZE),
+                    Image.Resampling.BOX if big else Image.Resampling.BILINEAR)
     bg  = Image.new("RGBA", (THUMB_SIZE, THUMB_SIZE), "#1a1a1a")
     ox  = (THUMB_SIZE - thumb.width)  // 2
     oy  = (THUMB_SIZE - thumb.height) // 2
     mask = thumb if thumb.mode == "RGBA" else None
     bg.paste(thumb, (ox, oy), mask)
-    return ImageTk.PhotoImage(bg)
+    return bg
+
+
+def _make_thumb_photo(img):
+    return ImageTk.PhotoImage(_fit_thumb(img))
+
+# ── Thumbnail cache ───────────────────────────────────────────────────────────
+# Letterboxed thumbnails are kept as PNG sidecars in THUMB_CACHE_DIR, keyed by
+# path + size + mtime. The print time rides along in a PNG text chunk, so a
+# cache hit never touches the G-code file.
+
+def _thumb_cache_path(path: Path, st: os.stat_result) -> Path:
+    key = hashlib.blake2b(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode(),
+                          digest_size=12).hexdigest()
+    return THUMB_CACHE_DIR / f"{key}.png"
+
+
+def _load_cached_thumb(cache_path: Path):
+    """Return (img, print_time) from the cache, or None on a miss."""
+    if not HAS_PIL or not cache_path.exists():
+        return None
+    try:
+        img = Image.open(cache_path)
+        img.load()
+        return img, img.text.get("print_time", "")
+    except Exception:
+        return None
+
+
+def _save_cached_thumb(cache_path: Path, img, print_time: str):
+    try:
+        THUMB_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        info = PngImagePlugin.PngInfo()
+        info.add_text("print_time", print_time)
+        img.save(cache_path, "PNG", pnginfo=info, optimize=False, compress_level=1)
+    except Exception:
+        pass
 
 # ── G-code parsing ────────────────────────────────────────────────────────────
 
-def _parse_print_time(text: str) -> str:
-    m = re.search(r'; estimated printing time \(normal mode\) = (.+)', text)
+def _search_ends(pattern: re.Pattern, data):
+    """Search the header, then the footer window of `data` (no slicing copies)."""
+    size = len(data)
+    m = pattern.search(data, 0, _TIME_SCAN_WINDOW)
+    if m is None and size > _TIME_SCAN_WINDOW:
+        m = pattern.search(data, max(_TIME_SCAN_WINDOW, size - _TIME_SCAN_WINDOW))
+    return m
+
+
+def _parse_print_time(data) -> str:
+    """Print time from slicer comments in the first/last _TIME_SCAN_WINDOW bytes."""
+    m = _search_ends(_RE_TIME_NORMAL, data)
     if m:
-        return m.group(1).strip()
-    m = re.search(r';TIME:(\d+)', text)
+        return m.group(1).strip().decode("utf-8", "replace")
+    m = _search_ends(_RE_TIME_SEC, data)
     if m:
         secs = int(m.group(1))
         h, r = divmod(secs, 3600)
@@ -250,29 +486,58 @@ def _parse_print_time(text: str) -> str:
         if mn: parts.append(f"{mn}м")
         if s:  parts.append(f"{s}с")
         return " ".join(parts)
-    m = re.search(r'; Build time: (.+)', text)
+    m = _search_ends(_RE_BUILD_TIME, data)
     if m:
-        return m.group(1).strip()
+        return m.group(1).strip().decode("utf-8", "replace")
     return ""
 
 
-def process_gcode(text: str, cooling_secs: int) -> str:
-    """Inject cooling block before every M84 if cooling_secs > 0."""
+def iter_processed_gcode(data, cooling_secs: int):
+    """Yield the G-code with a cooling block before every M84, without copying.
+
+    With cooling_secs == 0 the file is yielded unchanged; with no M84 at all,
+    cooling and M84 are appended at the end.
+
+    `data` is bytes or an mmap. Pieces are memoryview slices of it plus the
+    injected cooling blocks; the file is never split into lines — the scan
+    jumps between M84 occurrences with find(). Callers must drop the pieces
+    before an mmap behind `data` is closed.
+    """
+    view = memoryview(data)
     if cooling_secs == 0:
-        return text
+        yield view
+        return
 
-    lines     = text.splitlines(keepends=True)
-    out       = []
+    cooling   = COOLING_BLOCK.format(sec=cooling_secs).encode()
     found_m84 = False
-    for ln in lines:
-        if re.match(r'\s*M84\b', ln.strip()):
-            out.append(COOLING_BLOCK.format(sec=cooling_secs))
+    last      = 0
+    pos       = data.find(b'M84')
+    while pos >= 0:
+        start = data.rfind(b'\n', 0, pos) + 1
+        if _RE_M84.match(data, start):
+            yield view[last:start]
+            yield cooling
+            last      = start
             found_m84 = True
-        out.append(ln)
+        nl = data.find(b'\n', pos)
+        if nl < 0:
+            break
+        pos = data.find(b'M84', nl + 1)
+    yield view[last:]
     if not found_m84:
-        out.append(COOLING_BLOCK.format(sec=cooling_secs))
-        out.append("M84\n")
-    return "".join(out)
+        yield cooling
+        yield b"M84\n"
+
+
+def write_processed_gcode(src: Path, dst: Path, cooling_secs: int):
+    """Write `src` to `dst` with cooling injected, streaming from an mmap."""
+    with _map_file(src) as data, dst.open("wb") as f:
+        pieces = iter_processed_gcode(data, cooling_secs)
+        try:
+            f.writelines(pieces)
+        finally:
+            pieces.close()      # frees the generator's view before the map closes
+
 
 # ── Printer API (TCP socket, port 8080) ───────────────────────────────────────
 
@@ -298,40 +563,114 @@ def _recv_line(s: socket.socket, timeout: float = 3.0) -> str:
     return buf.decode(errors="ignore")
 
 
-def _drain_banner(s: socket.socket):
+def _drain_banner(s: socket.socket, wait: float = 0.1):
     """Consume the SHUI welcome banner sent on every new connection.
 
-    Banner arrives as 'Welcome to SHUI wifi module\\n'. During printing it may
-    come in multiple TCP packets, so we accumulate until we see '\\n'.
-    We stop after the banner line — waiting for a full 2 s timeout is wasteful
-    and risks the connection being recycled before M105 can be sent.
+    Banner arrives as 'Welcome to SHUI wifi module\\n', normally right after
+    connect. Wait briefly for its first packet instead of blocking for a full
+    second on modules that send no banner; once it starts, read to the '\\n'
+    since it may be split across TCP packets. The module sends it within a
+    few milliseconds of connect, so the 0.1 s wait is ample.
+    """
+    r, _, _ = select.select([s], [], [], wait)
+    if r:
+        _recv_line(s, timeout=wait)
+
+
+class _PrinterConn:
+    """Persistent TCP session to the SHUI WiFi module (port 8080).
+
+    Opening a connection costs a handshake plus the welcome banner, so one
+    socket is kept open across polls and terminal commands and reopened only
+    after an error, when the printer IP changes, or after sitting idle longer
+    than the status poll interval (the module may have dropped it silently).
+    A reused socket can still turn out dead. A missing reply can't be told
+    apart from a slow one, so only idempotent queries (M105/M27 polls) retry
+    on a fresh connection when `reused` is set; send() resends only if the
+    write itself failed. Callers must hold _tcp_lock.
     """
-    s.settimeout(1.0)
-    buf = bytearray()
-    while True:
-        try:
-            chunk = s.recv(512)
-            if not chunk:
-                break
-            buf.extend(chunk)
-            if b'\n' in buf:
-                break          # banner line complete
-        except (socket.timeout, OSError):
-            break
+
+    MAX_IDLE = 20.0         # seconds; a little over the 15 s status poll
+
+    def __init__(self):
+        self.sock: socket.socket | None = None
+        self.ip:   str | None = None
+        self.reused    = False      # last session() returned an existing socket
+        self.last_used = 0.0
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.ip   = None
+
+    def _ensure(self, ip: str, timeout: float) -> socket.socket:
+        if (self.sock is not None and self.ip == ip
+                and time.monotonic() - self.last_used < self.MAX_IDLE):
+            try:
+                self._flush()
+                self.reused = True
+                return self.sock
+            except OSError:
+                self.close()
+        else:
+            self.close()
+        self.reused = False
+        s = socket.create_connection((ip, 8080), timeout=timeout)
+        _drain_banner(s)
+        self.sock, self.ip = s, ip
+        return s
+
+    def _flush(self):
+        """Discard bytes left over from earlier replies (e.g. trailing 'ok').
+
+        Raises ConnectionError if the printer has closed the connection.
+        """
+        while select.select([self.sock], [], [], 0)[0]:
+            if not self.sock.recv(4096):
+                raise ConnectionError("connection closed by printer")
+
+    def session(self, ip: str, timeout: float) -> socket.socket:
+        """Return a connected socket with an empty receive buffer."""
+        s = self._ensure(ip, timeout)
+        s.settimeout(timeout)
+        self.last_used = time.monotonic()
+        return s
+
+    def send(self, ip: str, cmd: str, timeout: float = 3.0) -> str:
+        """Send one command and return its first response line ('' on failure)."""
+        for _ in range(2):
+            self.reused = False
+            try:
+                s = self.session(ip, timeout)
+                s.sendall((cmd + "\r\n").encode())
+            except OSError:
+                # The command never left, so resending can't run it twice
+                reused = self.reused
+                self.close()
+                if reused:
+                    continue
+                return ""
+            resp = _recv_line(s, timeout)
+            if not resp:
+                # Timeout or EOF: the command may still run, so don't resend
+                self.close()
+            return resp
+        return ""
+
+
+_printer_conn = _PrinterConn()
 
 
 def _tcp_command(ip: str, cmd: str, timeout: float = 3.0) -> str:
-    """Send a Marlin command over a fresh TCP connection and return the response."""
+    """Send a Marlin command over the shared TCP session and return the response."""
     if not _tcp_lock.acquire(timeout=5.0):
         return ""
     try:
-        with socket.create_connection((ip, 8080), timeout=timeout) as s:
-            _drain_banner(s)
-            s.settimeout(timeout)
-            s.sendall((cmd + "\r\n").encode())
-            return _recv_line(s, timeout)
-    except (socket.timeout, OSError):
-        return ""
+        return _printer_conn.send(ip, cmd, timeout)
     finally:
         _tcp_lock.release()
 
@@ -344,9 +683,7 @@ def get_printer_temps(ip: str) -> dict | None:
     """
     try:
         resp = _tcp_command(ip, "M105")
-        # T0? matches both "T:" (standard Marlin) and "T0:" (SHUI)
-        m = re.search(
-            r'T0?:(\d+\.?\d*)\s*/(\d+\.?\d*).*B:(\d+\.?\d*)\s*/(\d+\.?\d*)', resp)
+        m = _RE_TB.search(resp)
         if m:
             return {
                 "hotend": (float(m.group(1)), float(m.group(2))),
@@ -367,11 +704,12 @@ def get_printer_state(ip: str) -> str | None:
     """
     try:
         resp = _tcp_command(ip, "M27")
-        if re.search(r'SD printing byte \d+/\d+', resp):
+        if _RE_SDBYTE.search(resp):
             return "PRINTING"
-        if re.search(r'paused', resp, re.IGNORECASE):
+        rl = resp.lower()
+        if "paused" in rl:
             return "PAUSED"
-        if re.search(r'not sd printing', resp, re.IGNORECASE):
+        if "not sd printing" in rl:
             return "IDLE"
         return None
     except Exception:
@@ -382,7 +720,7 @@ def get_print_progress(ip: str) -> tuple[int, int] | None:
     """Return (bytes_done, bytes_total) or None."""
     try:
         resp = _tcp_command(ip, "M27")
-        m = re.search(r'SD printing byte (\d+)/(\d+)', resp)
+        m = _RE_SDBYTE.search(resp)
         return (int(m.group(1)), int(m.group(2))) if m else None
     except Exception:
         return None
@@ -395,11 +733,13 @@ def check_printer_online(ip: str | None = None) -> bool:
 
 
 def _query_printer_status(ip: str, timeout: float = 12.0, retries: int = 2) -> dict | None:
-    """Single TCP session: M105 + M27 in one connection.
+    """M105 + M27 over the shared TCP session.
 
     SHUI firmware handles only one connection at a time.  Two back-to-back
     connections from _do_check_printer caused the second one to time out.
-    Bundling both commands avoids the problem and halves TCP overhead.
+    Bundling both commands avoids the problem and halves TCP overhead;
+    _printer_conn extends the same batching across polls by keeping the
+    session open between them.
 
     Args:
         ip: Printer IP address
@@ -415,46 +755,51 @@ def _query_printer_status(ip: str, timeout: float = 12.0, retries: int = 2) -> d
     try:
         for attempt in range(retries):
             try:
-                with socket.create_connection((ip, 8080), timeout=timeout) as s:
-                    _drain_banner(s)
-                    s.settimeout(timeout)
-
-                    # M105 — temperatures
-                    s.sendall(b"M105\r\n")
-                    r105 = _recv_line(s, timeout)
-                    m = re.search(
-                        r'T0?:(\d+\.?\d*)\s*/(\d+\.?\d*).*B:(\d+\.?\d*)\s*/(\d+\.?\d*)', r105)
-                    if not m:
-                        return None
-
-                    # M27 — print progress (same open connection, no reconnect needed)
-                    s.sendall(b"M27\r\n")
-                    r27 = _recv_line(s, timeout)
-                    # Some firmware versions (or leftover M105 bytes) can produce an
-                    # "ok" acknowledgment line before the actual M27 state response.
-                    # If the first line doesn't contain recognisable M27 content,
-                    # try reading one more line.
-                    if not re.search(r'SD printing|Not SD printing|paused',
-                                     r27, re.IGNORECASE):
-                        extra = _recv_line(s, 2.0)
-                        if extra.strip():
-                            r27 = extra
-                    pm = re.search(r'SD printing byte (\d+)/(\d+)', r27)
-
-                    if pm:
-                        state = "PRINTING"
-                    elif re.search(r'paused', r27, re.IGNORECASE):
-                        state = "PAUSED"
-                    else:
-                        state = "IDLE"
-
-                    return {
-                        "hotend":   (float(m.group(1)), float(m.group(2))),
-                        "bed":      (float(m.group(3)), float(m.group(4))),
-                        "progress": (int(pm.group(1)), int(pm.group(2))) if pm else None,
-                        "state":    state,
-                    }
-            except (socket.timeout, OSError) as e:
+                s = _printer_conn.session(ip, timeout)
+                reused = _printer_conn.reused
+
+                # M105 — temperatures
+                s.sendall(b"M105\r\n")
+                r105 = _recv_line(s, timeout)
+                m = _RE_TB.search(r105)
+                if not m:
+                    if not r105:
+                        _printer_conn.close()
+                        # A kept-alive socket may have died while idle: retry
+                        # on a fresh connection instead of reporting offline
+                        if reused and attempt < retries - 1:
+                            continue
+                    return None
+
+                # M27 — print progress (same open connection, no reconnect needed)
+                s.sendall(b"M27\r\n")
+                r27 = _recv_line(s, timeout)
+                # Some firmware versions (or leftover M105 bytes) can produce an
+                # "ok" acknowledgment line before the actual M27 state response.
+                # If the first line doesn't contain recognisable M27 content,
+                # try reading one more line.
+                r27l = r27.lower()
+                if "sd printing" not in r27l and "paused" not in r27l:
+                    extra = _recv_line(s, 2.0)
+                    if extra.strip():
+                        r27 = extra
+                pm = _RE_SDBYTE.search(r27)
+
+                if pm:
+                    state = "PRINTING"
+                elif "paused" in r27.lower():
+                    state = "PAUSED"
+                else:
+                    state = "IDLE"
+
+                return {
+                    "hotend":   (float(m.group(1)), float(m.group(2))),
+                    "bed":      (float(m.group(3)), float(m.group(4))),
+                    "progress": (int(pm.group(1)), int(pm.group(2))) if pm else None,
+                    "state":    state,
+                }
+            except (socket.timeout, OSError):
+                _printer_conn.close()
                 if attempt < retries - 1:
                     continue
                 return None
@@ -484,7 +829,23 @@ def stop_print(ip: str) -> bool:
 _tcp_lock = threading.Lock()
 
 
-def upload_gcode(name: str, content: bytes,
+_PROGRESS_MIN_INTERVAL = 0.05       # upload progress callbacks: ≤20 per second
+
+
+def _upload_chunk_size(size: int) -> int:
+    """Pick a send chunk size for a payload of `size` bytes.
+
+    Bigger files get bigger chunks to cut per-send overhead, capped at 64 KB so
+    progress still moves several times a second at ESP8266 speeds (~80 KB/s).
+    """
+    if size < 1 << 20:
+        return 16 * 1024
+    if size < 8 << 20:
+        return 32 * 1024
+    return 64 * 1024
+
+
+def upload_gcode(name: str, source: bytes | Path | list,
                  progress_cb=None) -> tuple[bool, str]:
     """Upload gcode via SHUI multipart protocol with optional progress callback.
 
@@ -494,28 +855,33 @@ def upload_gcode(name: str, content: bytes,
         Connection: keep-alive headers
       - urllib3 applies connect-timeout to the send phase, causing large
         files to timeout; http.client with one socket timeout avoids this
+    `source` is the file content, a Path that is memory-mapped and sent
+    without being read into memory, or a list of bytes-like pieces (see
+    iter_processed_gcode) sent back to back.
     Progress callback: progress_cb(sent_bytes, total_bytes, speed_kbs)
     """
-    if not HAS_REQUESTS:
-        return False, "requests не установлен"
+    if isinstance(source, Path):
+        with _map_file(source) as data:
+            return upload_gcode(name, [memoryview(data)], progress_cb)
+    if not isinstance(source, list):
+        source = [memoryview(source)]     # slices without copying
     try:
-        import http.client as _http
+        size = sum(len(p) for p in source)
 
         boundary = b"----SHUIFormBoundary"
-        body = (
+        head = (
             b"--" + boundary + b"\r\n"
             b'Content-Disposition: form-data; name="file"; filename="'
             + name.encode() + b'"\r\n'
             b"Content-Type: application/octet-stream\r\n"
             b"\r\n"
-            + content
-            + b"\r\n--" + boundary + b"--\r\n"
         )
-        total   = len(body)
+        tail    = b"\r\n--" + boundary + b"--\r\n"
+        total   = len(head) + size + len(tail)
         timeout = max(60, total // 10_240 + 60)  # ≥10 KB/s + 60 s buffer
 
         ip   = _CFG["printer_ip"]
-        conn = _http.HTTPConnection(ip, 80, timeout=timeout)
+        conn = http.client.HTTPConnection(ip, 80, timeout=timeout)
         conn.putrequest("POST", "/upload", skip_accept_encoding=True)
         conn.putheader("Content-Type",
                        f"multipart/form-data; boundary={boundary.decode()}")
@@ -523,33 +889,47 @@ def upload_gcode(name: str, content: bytes,
         conn.endheaders()
 
         t0         = time.monotonic()
-        sent       = 0
-        chunk_size = 16 * 1024           # 16 KB chunks for smooth progress
+        last_cb    = 0.0
+        chunk_size = _upload_chunk_size(size)
         _win: list[tuple[float, int]] = []  # rolling 5-second speed window
 
-        for i in range(0, total, chunk_size):
-            chunk = body[i:i + chunk_size]
-            conn.send(chunk)
-            sent += len(chunk)
-            if progress_cb:
-                now = time.monotonic()
-                _win.append((now, sent))
-                while len(_win) > 1 and now - _win[0][0] > 5:
-                    _win.pop(0)
-                if len(_win) >= 2:
-                    dt = _win[-1][0] - _win[0][0]
-                    db = _win[-1][1] - _win[0][1]
-                    speed = db / (dt * 1024) if dt > 0 else 0
-                else:
-                    speed = sent / (max(now - t0, 0.1) * 1024)
-                progress_cb(sent, total, speed)
+        def _report(sent: int):
+            nonlocal last_cb
+            now = time.monotonic()
+            _win.append((now, sent))
+            while len(_win) > 1 and now - _win[0][0] > 5:
+                _win.pop(0)
+            if sent < total and now - last_cb < _PROGRESS_MIN_INTERVAL:
+                return
+            last_cb = now
+            if len(_win) >= 2:
+                dt = _win[-1][0] - _win[0][0]
+                db = _win[-1][1] - _win[0][1]
+                speed = db / (dt * 1024) if dt > 0 else 0
+            else:
+                speed = sent / (max(now - t0, 0.1) * 1024)
+            progress_cb(sent, total, speed)
+
+        conn.send(head)
+        sent = len(head)
+        for piece in source:
+            n = len(piece)
+            for i in range(0, n, chunk_size):
+                conn.send(piece[i:i + chunk_size])  # unbound slice: freed at once
+                sent += min(chunk_size, n - i)
+                if progress_cb:
+                    _report(sent)
+        conn.send(tail)
+        if progress_cb:
+            _report(total)
 
         resp    = conn.getresponse()
-        data    = json.loads(resp.read().decode())
+        data    = _loads(resp.read())
+        conn.close()
         elapsed = max(time.monotonic() - t0, 0.1)
 
         if data.get("err", 1) == 0:
-            speed_kbs = len(content) / (elapsed * 1024)
+            speed_kbs = size / (elapsed * 1024)
             return True, f"✓ Файл «{name}» отправлен  ({speed_kbs:.0f} КБ/с)"
         return False, f"Принтер вернул ошибку: {data}"
     except Exception as e:
@@ -565,7 +945,7 @@ class FlatBtn(tk.Frame):
     def __init__(self, parent, text="", command=None,
                  bg=BTN_N, fg=BTN_FG, font=None,
                  padx=14, pady=6, **kw):
-        active = _shade(bg, -10)
+        active = _ACTIVE_BG.get(bg) or _shade(bg, -10)
         super().__init__(parent, bg=bg, cursor="hand2", **kw)
         self._bg     = bg
         self._active = active
@@ -606,12 +986,14 @@ class FlatBtn(tk.Frame):
 # ── GcodeProject ──────────────────────────────────────────────────────────────
 
 class GcodeProject:
-    __slots__ = ("path", "name", "size_str", "print_time", "thumb_img", "thumb_photo")
+    __slots__ = ("path", "name", "stat", "size_str", "print_time",
+                 "thumb_img", "thumb_photo")
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, st: os.stat_result | None = None):
         self.path       = path
         self.name       = path.name
-        sz              = path.stat().st_size
+        self.stat       = st if st is not None else path.stat()
+        sz              = self.stat.st_size
         if sz >= 1_048_576:
             self.size_str = f"{sz/1_048_576:.1f} МБ"
         elif sz >= 1024:
@@ -624,15 +1006,43 @@ class GcodeProject:
 
     def load(self):
         try:
-            text = self.path.read_text(encoding="utf-8", errors="replace")
-            self.print_time = _parse_print_time(text)
-            img = _extract_orca_thumbnail(text)
-            if img is None:
+            st     = self.stat
+            cache  = _thumb_cache_path(self.path, st)
+            cached = _load_cached_thumb(cache)
+            if cached is not None:
+                self.thumb_img, self.print_time = cached
+                return
+
+            with _map_file(self.path) as data:
+                self.print_time = _parse_print_time(data)
+                img = _extract_orca_thumbnail(data)
+            if img is not None:
+                img = _fit_thumb(img)
+                _save_cached_thumb(cache, img, self.print_time)
+            else:
+                # Not cached: the key only covers the G-code, and the image
+                # next to it can be replaced on its own
                 img = _load_companion_image(self.path)
+                if img is not None:
+                    img = _fit_thumb(img)
             self.thumb_img = img
         except Exception:
             pass
 
+
+# Shared across scans so refreshes reuse warm worker threads
+_LOAD_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gcode-load")
+
+
+def load_projects(projects: list[GcodeProject]):
+    """Run GcodeProject.load() on _LOAD_POOL, yielding each project as it finishes.
+
+    Loading is file I/O plus base64/PNG decoding, independent per project.
+    """
+    futures = {_LOAD_POOL.submit(p.load): p for p in projects}
+    for fut in as_completed(futures):
+        yield futures[fut]
+
 # ── SendDialog ────────────────────────────────────────────────────────────────
 
 class SendDialog(tk.Toplevel):
@@ -848,12 +1258,7 @@ class HistoryDialog(tk.Toplevel):
     def _load_entries(self):
         for item in self._tree.get_children():
             self._tree.delete(item)
-        hist = []
-        try:
-            hist = json.loads(HISTORY_FILE.read_text())
-        except Exception:
-            pass
-        for entry in reversed(hist):
+        for entry in reversed(load_history()):
             self._tree.insert("", tk.END, values=(
                 entry.get("ts", ""),
                 entry.get("file", ""),
@@ -865,7 +1270,7 @@ class HistoryDialog(tk.Toplevel):
         if messagebox.askyesno("Очистить", "Удалить всю историю отправок?",
                                parent=self):
             try:
-                HISTORY_FILE.write_text("[]")
+                _write_history([])
             except Exception:
                 pass
             self._load_entries()
@@ -1039,7 +1444,8 @@ class UploadProgressPanel(tk.Frame):
 class TerminalPanel(tk.Frame):
     """Embedded G-code terminal panel."""
 
-    MAX_LINES  = 500
+    MAX_LINES    = 500
+    MAX_LINE_LEN = 2000       # Tk Text slows to a crawl on very long lines
     QUICK_CMDS = [
         ("M105", "температуры"),
         ("M27",  "прогресс"),
@@ -1050,8 +1456,12 @@ class TerminalPanel(tk.Frame):
     def __init__(self, parent, app, **kw):
         super().__init__(parent, bg=BG_HDR, **kw)
         self._app      = app
-        self._history: list[str] = []
+        self._history: deque[str] = deque(load_terminal_history(),
+                                           maxlen=TERMINAL_HISTORY_MAX)
         self._hist_pos = -1
+        self._line_count = 0
+        self._pending: list[tuple[str, str]] = []   # lines awaiting _flush
+        self._flush_id = None
         self._build()
 
     def _build(self):
@@ -1122,9 +1532,8 @@ class TerminalPanel(tk.Frame):
         if not cmd:
             return
         if not self._history or self._history[-1] != cmd:
-            self._history.append(cmd)
-            if len(self._history) > 100:
-                self._history.pop(0)
+            self._history.append(cmd)       # maxlen evicts the oldest
+            append_terminal_history(cmd)
         self._hist_pos = -1
         self._entry_var.set("")
         self._app._send_terminal_command(cmd)
@@ -1152,13 +1561,47 @@ class TerminalPanel(tk.Frame):
 
     def append(self, text: str, tag: str = "recv"):
         """Append a line to the output area (call from main thread only)."""
+        self.append_many([(text, tag)])
+
+    def append_many(self, items: list[tuple[str, str]]):
+        """Queue (text, tag) lines for the output area (main thread only).
+
+        Lines appended before Tk goes idle are written by one _flush.
+        """
+        self._pending += items
+        if self._flush_id is None and self._pending:
+            self._flush_id = self.after_idle(self._flush)
+
+    def _flush(self):
+        """Write all pending lines with a single insert/trim/scroll."""
+        self._flush_id = None
+        items, self._pending = self._pending, []
+        args  = []
+        added = 0
+        for text, tag in items:
+            # One call can't push more than MAX_LINES lines or an over-long line
+            lines = text.split("\n")[-self.MAX_LINES:]
+            lines = [ln if len(ln) <= self.MAX_LINE_LEN
+                     else ln[:self.MAX_LINE_LEN] + " …[truncated]" for ln in lines]
+            args += ("\n".join(lines) + "\n", tag)
+            added += len(lines)
+        if not args:
+            return
+        # Follow the output only if it was already at the bottom, so reading
+        # scrollback isn't interrupted (and see() is skipped entirely)
+        at_bottom = self._out.yview()[1] > 0.98
         self._out.configure(state=tk.NORMAL)
-        self._out.insert(tk.END, text + "\n", tag)
-        lines = int(self._out.index(tk.END).split(".")[0]) - 1
-        if lines > self.MAX_LINES:
-            self._out.delete("1.0", f"{lines - self.MAX_LINES}.0")
+        self._out.insert(tk.END, *args)
+        # Track the line count ourselves: trimming then drops a fixed number
+        # of leading lines instead of querying index(END) on every append.
+        self._line_count += added
+        excess = self._line_count - self.MAX_LINES
+        if excess > 0:
+            self._out.delete("1.0", f"{excess + 1}.0")
+            self._line_count = self.MAX_LINES
         self._out.configure(state=tk.DISABLED)
-        self._out.see(tk.END)
+        if at_bottom:
+            self._out.see(tk.END)
 
     def focus_entry(self):
         """Focus the command input field."""
@@ -1193,11 +1636,8 @@ class ProjectCard(tk.Frame):
         self._name_lbl.pack(padx=10)
 
         # Size + time badge
-        meta = self.project.size_str
-        if self.project.print_time:
-            meta += f"  ·  {self.project.print_time}"
         self._meta_lbl = tk.Label(
-            self, text=meta, bg=BG_CARD, fg=FG2,
+            self, text=self._meta_text(), bg=BG_CARD, fg=FG2,
             font=("Helvetica", 8))
         self._meta_lbl.pack(pady=(3, 10))
 
@@ -1214,7 +1654,19 @@ class ProjectCard(tk.Frame):
             w.bind("<Button-2>", self._ctx_menu)
             w.bind("<Button-3>", self._ctx_menu)
 
+    def _meta_text(self) -> str:
+        meta = self.project.size_str
+        if self.project.print_time:
+            meta += f"  ·  {self.project.print_time}"
+        return meta
+
+    def update_meta(self):
+        """Refresh the size/time badge after the project has been loaded."""
+        self._meta_lbl.configure(text=self._meta_text())
+
     def set_thumb(self, photo):
+        if getattr(self._thumb, "_photo", None) is photo:
+            return                      # already shown; avoid a Tk re-layout
         self._thumb.configure(image=photo,
                               width=THUMB_SIZE, height=THUMB_SIZE)
         self._thumb._photo = photo
@@ -1283,7 +1735,13 @@ class App(tk.Tk):
         PROJECTS_DIR.mkdir(parents=True, exist_ok=True)
 
         self._projects: list[GcodeProject] = []
+        self._card_by_path: dict[Path, ProjectCard] = {}
+        self._empty_frame: tk.Frame | None = None
+        self._placeholder = None
+        self._thumb_after = None    # pending _update_visible_thumbs call
+        self._search_after_id = None
         self._loading  = False
+        self._pending_scan: tuple[str, str] | None = None  # (search, sort) asked for mid-scan
         self._search_var = tk.StringVar()
         self._sort_var   = tk.StringVar(value="date")
         self._sort_btns: dict[str, FlatBtn] = {}
@@ -1292,6 +1750,11 @@ class App(tk.Tk):
         self._print_visible    = False
         self._print_track: list[tuple[float, int]] = []  # (monotonic, bytes_done)
         self._poll_fail_count  = 0
+        self._printer_state    = "IDLE"     # from the last status poll
+        # Terminal commands and status polls run one at a time on this worker
+        self._net_q: queue.Queue = queue.Queue()
+        threading.Thread(target=self._net_worker, name="printer-net",
+                         daemon=True).start()
 
         self._build_ui()
         self._refresh()
@@ -1374,7 +1837,7 @@ class App(tk.Tk):
         search_wrap.pack(side=tk.LEFT, padx=(14, 0), pady=8)
         tk.Label(search_wrap, text="🔍", bg=BG_INP, fg=FG_DIM,
                  font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(6, 2))
-        self._search_var.trace_add("write", lambda *_: self._refresh())
+        self._search_var.trace_add("write", self._on_search_change)
         tk.Entry(search_wrap, textvariable=self._search_var,
                  bg=BG_INP, fg=FG, insertbackground=FG,
                  relief=tk.FLAT, font=("Helvetica", 9), width=22,
@@ -1427,8 +1890,8 @@ class App(tk.Tk):
 
         # ── Terminal (hidden by default) ───────────────────────────────────────
         self._terminal_sep = tk.Frame(self, bg=SEP, height=1)
-        self._terminal     = TerminalPanel(self, app=self)
-        # Not packed — _toggle_terminal manages visibility
+        self._terminal: TerminalPanel | None = None
+        # Built and packed on first use — _toggle_terminal manages visibility
 
         # ── Scrollable canvas ──────────────────────────────────────────────────
         canvas_frame = tk.Frame(self, bg=BG)
@@ -1436,7 +1899,8 @@ class App(tk.Tk):
         self._canvas = tk.Canvas(canvas_frame, bg=BG, highlightthickness=0)
         vsb = ttk.Scrollbar(canvas_frame, orient=tk.VERTICAL,
                             command=self._canvas.yview)
-        self._canvas.configure(yscrollcommand=vsb.set)
+        self._vsb = vsb
+        self._canvas.configure(yscrollcommand=self._on_canvas_yview)
         vsb.pack(side=tk.RIGHT, fill=tk.Y)
         self._canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
@@ -1446,9 +1910,10 @@ class App(tk.Tk):
 
         self._inner.bind("<Configure>", self._on_inner_configure)
         self._canvas.bind("<Configure>", self._on_canvas_configure)
-        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
-            self._canvas.bind(seq, self._on_scroll)
-        self.bind_all("<MouseWheel>", self._on_scroll)
+        # Wheel is routed to the grid only while the pointer is over it, so
+        # other scrollables (terminal) don't scroll the grid as well.
+        self._canvas.bind("<Enter>", self._bind_wheel)
+        self._canvas.bind("<Leave>", self._unbind_wheel)
 
         if self._dnd_enabled:
             self._canvas.drop_target_register(DND_FILES)
@@ -1462,6 +1927,57 @@ class App(tk.Tk):
     def _on_canvas_configure(self, evt):
         self._canvas.itemconfig(self._win_id, width=evt.width)
 
+    def _on_canvas_yview(self, first, last):
+        # Canvas reports every view change here: scrolls, resizes, re-layouts
+        self._vsb.set(first, last)
+        self._schedule_thumb_update()
+
+    def _schedule_thumb_update(self):
+        if self._thumb_after is None:
+            self._thumb_after = self.after_idle(self._update_visible_thumbs)
+
+    def _update_visible_thumbs(self):
+        """Create PhotoImages only for cards in (or near) the viewport.
+
+        Off-screen cards fall back to the shared placeholder and drop their
+        photo; the PIL thumbnail stays on the project for when they return.
+        """
+        self._thumb_after = None
+        if not self._card_by_path or not HAS_PIL:
+            return
+        self._inner.update_idletasks()
+        top    = self._canvas.canvasy(0)
+        height = self._canvas.winfo_height()
+        lo, hi = top - height / 2, top + height * 1.5   # prefetch half a screen
+        for card in self._card_by_path.values():
+            proj = card.project
+            y = card.winfo_y()
+            visible = y + card.winfo_height() >= lo and y <= hi
+            if visible and proj.thumb_photo is None and proj.thumb_img is not None:
+                proj.thumb_photo = _make_thumb_photo(proj.thumb_img)
+                card.set_thumb(proj.thumb_photo)
+            elif not visible and proj.thumb_photo is not None:
+                proj.thumb_photo = None
+                card.set_thumb(self._placeholder)
+
+    _WHEEL_SEQS = ("<MouseWheel>", "<Button-4>", "<Button-5>")
+
+    def _bind_wheel(self, _evt=None):
+        for seq in self._WHEEL_SEQS:
+            self.bind_all(seq, self._on_scroll)
+
+    def _unbind_wheel(self, evt):
+        # Moving onto a card inside the canvas also fires <Leave>; keep the
+        # binding in that case.
+        try:
+            w = self.winfo_containing(evt.x_root, evt.y_root)
+        except KeyError:
+            w = None
+        if w is not None and str(w).startswith(str(self._canvas)):
+            return
+        for seq in self._WHEEL_SEQS:
+            self.unbind_all(seq)
+
     def _on_scroll(self, evt):
         if evt.num == 4:
             self._canvas.yview_scroll(-1, "units")
@@ -1470,6 +1986,16 @@ class App(tk.Tk):
         elif evt.delta:
             self._canvas.yview_scroll(-1 * (evt.delta // 120), "units")
 
+    def _on_search_change(self, *_):
+        # Debounce: one rescan per typing burst, not one per keystroke
+        if self._search_after_id:
+            self.after_cancel(self._search_after_id)
+        self._search_after_id = self.after(200, self._on_search_idle)
+
+    def _on_search_idle(self):
+        self._search_after_id = None
+        self._refresh()
+
     def _set_sort(self, key: str):
         self._sort_var.set(key)
         for k, btn in self._sort_btns.items():
@@ -1493,6 +2019,8 @@ class App(tk.Tk):
             self._terminal.pack_forget()
             self._terminal_visible = False
         else:
+            if self._terminal is None:
+                self._terminal = TerminalPanel(self, app=self)
             self._terminal_sep.pack(side=tk.BOTTOM, fill=tk.X)
             self._terminal.pack(side=tk.BOTTOM, fill=tk.X)
             self._terminal_visible = True
@@ -1527,12 +2055,19 @@ class App(tk.Tk):
         self._print_panel.pack_forget()
         self._print_visible = False
 
+    def _net_worker(self):
+        """Run queued (fn, args) printer jobs in order, for the app's lifetime."""
+        while True:
+            fn, args = self._net_q.get()
+            try:
+                fn(*args)
+            except Exception:
+                pass
+
     def _send_terminal_command(self, cmd: str):
         ts = datetime.now().strftime("%H:%M:%S")
         self._terminal.append(f"[{ts}] >> {cmd}", "sent")
-        threading.Thread(
-            target=self._do_terminal_command, args=(_CFG["printer_ip"], cmd),
-            daemon=True).start()
+        self._net_q.put((self._do_terminal_command, (_CFG["printer_ip"], cmd)))
 
     def _do_terminal_command(self, ip: str, cmd: str):
         resp = _tcp_command(ip, cmd)
@@ -1550,20 +2085,30 @@ class App(tk.Tk):
 
     def _pause_print_action(self):
         """Handle pause/resume button click."""
-        # Check current printer state to determine action
-        state = get_printer_state(_CFG["printer_ip"])
-        
+        # The last poll's state is what the button shows; acting on it saves a
+        # separate M27 round trip on the UI thread. A successful M25/M24
+        # updates it right away so the next click doesn't repeat the command.
+        state = self._printer_state
+
         if state == "PRINTING":
             # Pause the print
             ok = pause_print(_CFG["printer_ip"])
             self._set_status("Печать на паузе" if ok else "Ошибка: не удалось поставить на паузу")
+            if ok:
+                self._set_printer_state("PAUSED")
         elif state == "PAUSED":
             # Resume the print
             ok = resume_print(_CFG["printer_ip"])
             self._set_status("Печать возобновлена" if ok else "Ошибка: не удалось возобновить")
+            if ok:
+                self._set_printer_state("PRINTING")
         else:
             self._set_status(f"Ошибка: неожиданное состояние принтера ({state})")
 
+    def _set_printer_state(self, state: str):
+        """Apply a state change we caused, keeping the current status text."""
+        self._apply_printer_status(True, self._dot_lbl.cget("text"), state)
+
     def _stop_print_action(self):
         if messagebox.askyesno("Остановить печать",
                                "Остановить текущую печать?\n\nЭто аварийная остановка - все нагреватели будут выключены!", parent=self):
@@ -1573,42 +2118,65 @@ class App(tk.Tk):
     # ── Project loading ───────────────────────────────────────────────────────
 
     def _refresh(self):
+        search = self._search_var.get().lower().strip()
+        sort   = self._sort_var.get()
         if self._loading:
+            # Only the latest request matters; _finish_scan runs it
+            self._pending_scan = (search, sort)
             return
+        self._start_scan(search, sort)
+
+    def _start_scan(self, search: str, sort: str):
         self._loading = True
-        search = self._search_var.get().lower().strip()
-        sort   = self._sort_var.get()
         self._set_status("Сканирование…")
         threading.Thread(target=self._scan, args=(search, sort), daemon=True).start()
 
     def _scan(self, search: str, sort: str):
         try:
-            all_files = list(PROJECTS_DIR.glob("*.gcode"))
-            if search:
-                all_files = [f for f in all_files if search in f.name.lower()]
+            # scandir + suffix check instead of glob's per-entry fnmatch; the
+            # DirEntry stat (one per file) feeds both the sort and GcodeProject
+            with os.scandir(PROJECTS_DIR) as it:
+                entries = [(Path(e.path), e.stat()) for e in it
+                           if e.name.endswith(".gcode")
+                           and not e.name.startswith(".")   # as glob("*")
+                           and (not search or search in e.name.lower())
+                           and e.is_file()]
             if sort == "date":
-                files = sorted(all_files, key=lambda p: p.stat().st_mtime, reverse=True)
+                entries.sort(key=lambda e: e[1].st_mtime, reverse=True)
             elif sort == "name":
-                files = sorted(all_files, key=lambda p: p.name.lower())
+                entries.sort(key=lambda e: e[0].name.lower())
             elif sort == "size":
-                files = sorted(all_files, key=lambda p: p.stat().st_size, reverse=True)
-            else:
-                files = all_files
-            projects = [GcodeProject(f) for f in files]
-            for p in projects:
-                p.load()
+                entries.sort(key=lambda e: e[1].st_size, reverse=True)
+            projects = [GcodeProject(f, st) for f, st in entries]
+            # Cards appear right away with placeholders; thumbnails fill in
+            # as the pool finishes loading each file.
             self.after(0, self._render_projects, projects)
+            for proj in load_projects(projects):
+                self.after(0, self._on_project_loaded, proj)
+            self.after(0, self._finish_scan, len(projects))
         except Exception as e:
             self.after(0, self._set_status, f"Ошибка сканирования: {e}")
-            self._loading = False
+            self.after(0, self._finish_scan, 0)
 
     def _render_projects(self, projects: list[GcodeProject]):
-        for w in self._inner.winfo_children():
-            w.destroy()
+        """Reconcile the card grid with `projects`.
+
+        Cards are keyed by path: cards for removed files are destroyed, new
+        files get new cards, and surviving cards are re-pointed at their fresh
+        GcodeProject and moved with grid_configure.
+        """
         self._projects = projects
+        old = self._card_by_path
+        new_paths = {p.path for p in projects}
+        for path in [p for p in old if p not in new_paths]:
+            old.pop(path).destroy()
+
+        if self._empty_frame is not None:
+            self._empty_frame.destroy()
+            self._empty_frame = None
 
         if not projects:
-            empty = tk.Frame(self._inner, bg=BG)
+            empty = self._empty_frame = tk.Frame(self._inner, bg=BG)
             empty.pack(pady=100)
             tk.Label(empty, text="Нет файлов .gcode",
                      bg=BG, fg=FG2,
@@ -1617,32 +2185,56 @@ class App(tk.Tk):
                      bg=BG, fg=FG_DIM,
                      font=("Helvetica", 10)).pack(pady=(8, 0))
             self._set_status("Папка projects/ пуста")
-            self._loading = False
             return
 
         for c in range(CARDS_PER_ROW):
             self._inner.columnconfigure(c, weight=1)
 
-        _ph = _placeholder_photo() if HAS_PIL else None
+        _ph = self._placeholder = _placeholder_photo() if HAS_PIL else None
 
         for i, proj in enumerate(projects):
             row, col = divmod(i, CARDS_PER_ROW)
-            card = ProjectCard(self._inner, proj,
-                               on_send=self._send_project,
-                               on_reload=self._refresh,
-                               width=CARD_W)
-            card.grid(row=row, column=col,
-                      padx=CARD_PAD, pady=CARD_PAD, sticky="n")
-            if proj.thumb_img is not None and HAS_PIL:
-                photo = _make_thumb_photo(proj.thumb_img)
-                card.set_thumb(photo)
-                proj.thumb_photo = photo
-            elif _ph:
+            card = old.get(proj.path)
+            if card is None:
+                card = ProjectCard(self._inner, proj,
+                                   on_send=self._send_project,
+                                   on_reload=self._refresh,
+                                   width=CARD_W)
+                card.grid(row=row, column=col,
+                          padx=CARD_PAD, pady=CARD_PAD, sticky="n")
+                if _ph:
+                    card.set_thumb(_ph)
+                old[proj.path] = card
+                continue
+            prev = card.project
+            if (prev.stat.st_mtime_ns, prev.stat.st_size) == \
+                    (proj.stat.st_mtime_ns, proj.stat.st_size):
+                # Unchanged file: keep what is already shown until reload
+                proj.print_time  = prev.print_time
+                proj.thumb_img   = prev.thumb_img
+                proj.thumb_photo = prev.thumb_photo
+            elif prev.thumb_photo is not None and _ph:
                 card.set_thumb(_ph)
+            card.project = proj
+            card.update_meta()
+            card.grid_configure(row=row, column=col)
+        self._schedule_thumb_update()
+
+    def _on_project_loaded(self, proj: GcodeProject):
+        card = self._card_by_path.get(proj.path)
+        if card is None or card.project is not proj:   # superseded by a newer scan
+            return
+        card.update_meta()
+        if proj.thumb_img is not None:
+            self._schedule_thumb_update()
 
-        count = len(projects)
-        self._set_status(f"Найдено: {count} {'файл' if count == 1 else 'файла' if 2 <= count <= 4 else 'файлов'}")
+    def _finish_scan(self, count: int):
+        if count:
+            self._set_status(f"Найдено: {count} {_plural(count, _FILE_FORMS)}")
         self._loading = False
+        if self._pending_scan is not None:
+            params, self._pending_scan = self._pending_scan, None
+            self._start_scan(*params)
 
     # ── Drag & Drop ───────────────────────────────────────────────────────────
 
@@ -1657,12 +2249,12 @@ class App(tk.Tk):
                     shutil.copy2(src, dst)
                     added += 1
         self._refresh()
-        self._set_status(f"Добавлено: {added} файл(ов)")
+        self._set_status(f"Добавлено: {added} {_plural(added, _FILE_FORMS)}")
 
     # ── Printer status ────────────────────────────────────────────────────────
 
     def _schedule_printer_check(self):
-        threading.Thread(target=self._do_check_printer, daemon=True).start()
+        self._net_q.put((self._do_check_printer, ()))
 
     def _do_check_printer(self):
         ip     = _CFG["printer_ip"]
@@ -1714,18 +2306,18 @@ class App(tk.Tk):
                 self.after(0, self._hide_print_bar)
                 self.after(0, self._apply_printer_status, False, "Offline", "IDLE")
 
-        if status and self._terminal_visible:
-            ts = datetime.now().strftime("%H:%M:%S")
-            t_cur, t_tgt = status["hotend"]
-            b_cur, b_tgt = status["bed"]
-            prog = status["progress"]
-            line = f"[{ts}] ~  T:{t_cur:.0f}/{t_tgt:.0f}  B:{b_cur:.0f}/{b_tgt:.0f}"
-            if prog and prog[1] > 0:
-                line += f"  {int(100 * prog[0] / prog[1])}%"
-            self.after(0, self._terminal.append, line, "status")
-        elif not status and self._terminal_visible:
+        if self._terminal_visible:
             ts = datetime.now().strftime("%H:%M:%S")
-            self.after(0, self._terminal.append, f"[{ts}] ~  offline", "status")
+            if status:
+                t_cur, t_tgt = status["hotend"]
+                b_cur, b_tgt = status["bed"]
+                prog = status["progress"]
+                line = f"[{ts}] ~  T:{t_cur:.0f}/{t_tgt:.0f}  B:{b_cur:.0f}/{b_tgt:.0f}"
+                if prog and prog[1] > 0:
+                    line += f"  {int(100 * prog[0] / prog[1])}%"
+            else:
+                line = f"[{ts}] ~  offline"
+            self.after(0, self._terminal.append_many, [(line, "status")])
 
         self.after(15_000, self._schedule_printer_check)
 
@@ -1743,7 +2335,8 @@ class App(tk.Tk):
         else:
             self._dot.configure(fg=RED)
             self._dot_lbl.configure(text="Offline", fg=FG_DIM)
-        
+        self._printer_state = state
+
         # Show/hide buttons based on printer state
         if state == "PRINTING":
             self._pause_btn.configure(text="⏸  Пауза", bg=BTN_N, fg=BTN_FG)
@@ -1783,12 +2376,9 @@ class App(tk.Tk):
 
     def _do_save(self, project: GcodeProject, cooling_secs: int):
         try:
-            self.after(0, self._set_status, "Читаю файл…")
-            text = project.path.read_text(encoding="utf-8", errors="replace")
             self.after(0, self._set_status, "Обрабатываю G-code…")
-            processed = process_gcode(text, cooling_secs)
             out = project.path.with_stem(project.path.stem + "_processed")
-            out.write_text(processed, encoding="utf-8")
+            write_processed_gcode(project.path, out, cooling_secs)
             subprocess.run(["open", "-R", str(out)])
             self.after(0, self._set_status, f"Сохранено: {out.name}")
         except Exception as e:
@@ -1798,22 +2388,14 @@ class App(tk.Tk):
 
     def _do_send(self, project: GcodeProject, cooling_secs: int):
         try:
-            self.after(0, self._set_status, "Читаю файл…")
-            text = project.path.read_text(encoding="utf-8", errors="replace")
-            self.after(0, self._set_status, "Обрабатываю G-code…")
-            processed = process_gcode(text, cooling_secs)
-            content = processed.encode("utf-8")
-            size_kb = len(content) / 1024
-
-            self.after(0, self._show_upload_bar)
-            self.after(0, self._set_status,
-                       f"Отправляю «{project.name}»  {size_kb:.0f} КБ…")
-
-            def _progress(sent, total, speed_kbs):
-                self.after(0, self._upload_panel.update_progress,
-                           project.name, sent, total, speed_kbs)
-
-            ok, msg = upload_gcode(project.name, content, progress_cb=_progress)
+            with _map_file(project.path) as data:
+                # Pieces are views into the map plus cooling blocks, so the
+                # file is streamed from disk instead of copied into memory.
+                pieces = list(iter_processed_gcode(data, cooling_secs))
+                try:
+                    ok, msg = self._upload_pieces(project, pieces)
+                finally:
+                    pieces.clear()      # drop views before the map closes
             self.after(0, self._hide_upload_bar)
             append_history({
                 "ts":      datetime.now().isoformat(timespec="seconds"),
@@ -1831,6 +2413,37 @@ class App(tk.Tk):
             self.after(0, self._set_status, msg)
             self.after(0, messagebox.showerror, "Ошибка", msg)
 
+    def _upload_pieces(self, project: GcodeProject, pieces: list) -> tuple[bool, str]:
+        """Upload `pieces` (see upload_gcode) with the progress bar shown."""
+        size_kb = sum(len(p) for p in pieces) / 1024
+        self.after(0, self._show_upload_bar)
+        self.after(0, self._set_status,
+                   f"Отправляю «{project.name}»  {size_kb:.0f} КБ…")
+
+        # Keep at most one progress update queued on the Tk loop; it
+        # always renders the latest numbers.
+        latest: list = [None]
+        latest_lock  = threading.Lock()
+        last_ui      = [0.0]
+
+        def _flush_progress():
+            with latest_lock:
+                args, latest[0] = latest[0], None
+            self._upload_panel.update_progress(project.name, *args)
+
+        def _progress(sent, total, speed_kbs):
+            now = time.monotonic()
+            if sent < total and now - last_ui[0] < 0.1:   # ≤10 UI updates/s
+                return
+            last_ui[0] = now
+            with latest_lock:
+                queue_it  = latest[0] is None
+                latest[0] = (sent, total, speed_kbs)
+            if queue_it:
+                self.after(0, _flush_progress)
+
+        return upload_gcode(project.name, pieces, progress_cb=_progress)
+
     # ── Helpers ───────────────────────────────────────────────────────────────
 
     def _set_status(self, text: str):